@@ -4,70 +4,334 @@ Load images and annotate the A and P point
 Written by Andreas Kist and modified by Julian Zilker
 """
 
+import os
+import sys
+
+# Pin the Qt binding before pyqtgraph (or anything using qtpy) probes for one
+os.environ.setdefault("PYQTGRAPH_QT_LIB", "PyQt5")
+os.environ.setdefault("QT_API", "pyqt5")
+
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QGridLayout, QWidget, QSlider, QLabel, QCheckBox, QSizePolicy
-from PyQt5.QtCore import pyqtSignal, Qt
+from PyQt5.QtCore import pyqtSignal, Qt, QRunnable, QThreadPool, QTimer
+from PyQt5.QtGui import QPainter
 import pyqtgraph as pg
-import imageio as io
 import numpy as np
 import json
-import os
-from glob import glob
+import threading
+from collections import OrderedDict
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbojpeg = None
+
+# Images are (H, W, C), so let pyqtgraph consume them without transposing.
+pg.setConfigOptions(imageAxisOrder='row-major', enableExperimental=False)
+
+# If available, numba accelerates pyqtgraph's level rescaling and ARGB conversion
+#  (the option exists since pyqtgraph 0.12.2, older versions reject unknown options)
+if numba is not None and 'useNumba' in pg.CONFIG_OPTIONS:
+    pg.setConfigOptions(useNumba=True)
+
+# Layout invariants, shared by all stacks
+EXPANDING = QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+FIXED_WIDTH = QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Expanding)
+
+
+def decodeImage(path):
+    """
+    Decodes an image with the fastest available backend,
+    i.e. libjpeg-turbo for JPEGs and OpenCV for PNGs, and imageio otherwise.
+
+    :param path: str, image file
+    :return: ndarray (H, W[, C]) in RGB(A) channel order
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext in ('.jpg', '.jpeg') and turbojpeg is not None:
+        with open(path, 'rb') as fp:
+            return turbojpeg.decode(fp.read(), pixel_format=TJPF_RGB)
+
+    if ext == '.png' and cv2 is not None:
+        im = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+        # OpenCV returns None instead of raising, e.g. for truncated files
+        #  or non-ASCII paths on Windows, leave those to imageio
+        if im is not None:
+            # OpenCV decodes to BGR(A)
+            if im.ndim == 3 and im.shape[2] == 3:
+                im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+
+            elif im.ndim == 3 and im.shape[2] == 4:
+                im = cv2.cvtColor(im, cv2.COLOR_BGRA2RGBA)
+
+            return im
+
+    # imageio is only imported if it is actually needed
+    import imageio as io
+
+    return io.imread(path)
+
+
+def readImage(path, fullDepth=False):
+    """
+    Reads an image for display, converted to uint8 unless fullDepth is set.
+    This halves the memory traffic of 16 bit images on the rendering path:
+    16 bit images keep their upper byte, other types are clipped to 0..255.
+
+    :param path: str, image file
+    :param fullDepth: boolean, keep the original bit depth
+    :return: ndarray (H, W[, C]) in RGB(A) channel order
+    """
+    im = decodeImage(path)
+
+    if not fullDepth and im.dtype != np.uint8:
+        if im.dtype == np.uint16:
+            im = (im >> 8).astype(np.uint8)
+
+        else:
+            im = np.clip(im, 0, 255).astype(np.uint8)
+
+    return im
+
+
+def loadPoints(fn):
+    """
+    Loads a points file, using orjson if available.
+
+    :param fn: str, points file
+    :return: dict
+    """
+    if orjson is not None:
+        with open(fn, 'rb') as fp:
+            return orjson.loads(fp.read())
+
+    with open(fn, 'r') as fp:
+        return json.load(fp)
+
+
+def dumpPoints(fn, obj):
+    """
+    Saves a points file, using orjson if available.
+    Both produce the same 2-space indented output.
+
+    :param fn: str, points file
+    :param obj: dict
+    """
+    if orjson is not None:
+        with open(fn, 'wb') as fp:
+            fp.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+
+    else:
+        with open(fn, 'w') as fp:
+            json.dump(obj, fp, indent=2)
+
+
+def isRotational(path):
+    """
+    Checks if path lives on a spinning disk, using sysfs on Linux.
+
+    :param path: str, file or folder
+    :return: boolean, True if it cannot be determined
+    """
+    # sysfs (and os.major/os.minor) are not available elsewhere
+    if not sys.platform.startswith("linux"):
+        return True
+
+    try:
+        dev = os.stat(path).st_dev
+        block = os.path.realpath("/sys/dev/block/{}:{}".format(os.major(dev), os.minor(dev)))
+
+        # Partitions keep the queue information in their parent device
+        for folder in (block, os.path.dirname(block)):
+            fn = os.path.join(folder, "queue", "rotational")
+
+            if os.path.isfile(fn):
+                with open(fn, 'r') as fp:
+                    return fp.read().strip() == "1"
+
+    except (OSError, ValueError):
+        pass
+
+    return True
 
-from PyQt5.QtCore import pyqtRemoveInputHook
-from pdb import set_trace
+
+def warmPageCache(files, limit=500):
+    """
+    Asks the OS to read the first files into its page cache,
+    such that decoding them later does not wait for the disk.
+
+    :param files: list of files
+    :param limit: maximum number of files to warm
+    """
+    for fn in files[:limit]:
+        try:
+            if hasattr(os, "posix_fadvise"):
+                fd = os.open(fn, os.O_RDONLY)
+
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+                finally:
+                    os.close(fd)
+
+            else:
+                with open(fn, 'rb') as fp:
+                    fp.read(4096)
+
+        except OSError:
+            pass
 
 
 def trace():
+    # Imported here, pdb is a heavy import only needed for debugging
+    from PyQt5.QtCore import pyqtRemoveInputHook
+    from pdb import set_trace
+
     pyqtRemoveInputHook()
     set_trace()
 
 
 class ROI:
-    def __init__(self, pos=[100, 100], shown=True):
+    def __init__(self, stack, z, i):
         """
         ROI class that keeps ROI position and if it is active.
+        It is a view onto the ROI arrays of the stack.
+
+        :param stack: Stack keeping roi_pos and roi_shown
+        :param z: frame id
+        :param i: ROI id
+        """
+        self.stack = stack
+        self.z = z
+        self.id = i
+
+    @property
+    def pos(self):
+        return self.stack.roi_pos[self.z, self.id]
 
+    @pos.setter
+    def pos(self, pos):
+        """
         :param pos: list, tuple or pyqtgraph Point
-        :param shown: boolean
         """
-        self.pos = pos
-        self.shown = shown
+        self.stack.roi_pos[self.z, self.id] = pos[0], pos[1]
+
+    @property
+    def shown(self):
+        return bool(self.stack.roi_shown[self.z, self.id])
 
-    def serialize(self):
+    @shown.setter
+    def shown(self, shown):
+        self.stack.roi_shown[self.z, self.id] = shown
+
+class Prefetcher(QRunnable):
+    def __init__(self, stack, ids):
         """
-        Serializes object to dictionary
-        :return: dict
+        Background task that decodes frames and their segmentations into the stack's cache.
+
+        :param stack: Stack whose cache is filled
+        :param ids: iterable of frame ids to load
         """
-        return {'pos': tuple(self.pos), 'shown': self.shown}
+        super().__init__()
+        self.stack = stack
+        self.ids = ids
+
+    def run(self):
+        for i in self.ids:
+            self.stack.readFrame(i)
+
+            if self.stack.showSeg:
+                self.stack.readSeg(i)
+
 
 class ImageView(pg.ImageView):
     keysignal = pyqtSignal(int)
     mousesignal = pyqtSignal(int)
 
-    def __init__(self, im, rois=None, parent=None):
+    def __init__(self, im, rois=None, parent=None, levels=None):
         """
         Custom ImageView class to handle ROIs dynamically
 
         :param im: The image to be shown
         :param rois: The rois for this image
         :param parent: The parent widget where the window is embedded
+        :param levels: None or (min, max) levels, computed from im if None
         """
         # Set Widget as parent to show ImageView in Widget
         super().__init__(parent=parent)
 
         # Set 2D image
-        self.setImage(im)
+        self.setImage(im, autoLevels=levels is None, levels=levels)
         self.rois = rois
         self.realRois = []
         self.colors = ['1a87f4', 'ebf441', '9b1a9b', '42f489']
         self.getView().setMenuEnabled(False)
 
+        # Segmentation overlay, added on top of the image
+        self.seg = pg.ImageItem()
+        self.seg.setCompositionMode(QPainter.CompositionMode_Plus)
+        self.seg.setOpacity(0.5)
+        self.getView().addItem(self.seg)
+
+        # Coalesce ROI changes while dragging into one store per ~60 Hz frame
+        self.saveTimer = QTimer(self)
+        self.saveTimer.setSingleShot(True)
+        self.saveTimer.setInterval(16)
+        self.saveTimer.timeout.connect(self.storeROIs)
+
+        # Refresh the histogram only once scrubbing through z paused
+        self.histTimer = QTimer(self)
+        self.histTimer.setSingleShot(True)
+        self.histTimer.setInterval(100)
+        self.histTimer.timeout.connect(self.ui.histogram.imageChanged)
+
+        self.createROIs()
         self.updateROIs()
 
         # Set reference to stack
         self.stack = parent
 
 
+    def swapImage(self, im):
+        """
+        Swaps the pixels of the shown image, keeping the levels and view.
+        Unlike setImage, nothing else of the ImageView is rebuilt.
+
+        :param im: The image to be shown
+        """
+        self.image = im
+        self.imageDisp = None
+
+        # Do not let the histogram rescan every single image
+        imageItem = self.getImageItem()
+        imageItem.blockSignals(True)
+        imageItem.setImage(im, autoLevels=False)
+        imageItem.blockSignals(False)
+
+        self.histTimer.start()
+
     def mousePressEvent(self, e):
         # Important, map xy coordinates to scene!
         xy = self.getImageItem().mapFromScene(e.pos())
@@ -90,23 +354,16 @@ class ImageView(pg.ImageView):
         if e.button() == Qt.MiddleButton:
             self.stack.z.setValue(self.stack.curId + 1)
 
-    def updateROIs(self):
+    def createROIs(self):
         """
-        Cleans current ROIs from scene and creates the ROIs for the current image.
+        Creates the ROIs once and adds them to the scene.
+        They are reused for every image, see updateROIs.
 
         :return:
         """
-        # Remove all ROIs on scene
-        for i in self.realRois:
-            self.getView().removeItem(i)
-
-        self.realRois = []
-
-        # Iterate across ROIs
         if self.rois is not None:
-            i = 0
             ### Create ROIs with different colors ###
-            for r in self.rois:
+            for i, r in enumerate(self.rois):
                 t = pg.CrosshairROI(r.pos)
                 t.setPen(pg.mkPen(self.colors[i]))
                 t.aspectLocked = True
@@ -114,23 +371,51 @@ class ImageView(pg.ImageView):
                 ### Storing, not actually saving! ###
                 t.sigRegionChanged.connect(self.saveROIs)
                 self.realRois.append(t)
+                self.getView().addItem(t)
 
-                if r.shown:
-                    self.getView().addItem(self.realRois[-1])
+    def updateROIs(self):
+        """
+        Moves the existing ROIs to the positions of the current image and shows or hides them.
 
-                i += 1
+        :return:
+        """
+        # Store pending ROI changes first, they belong to the current rois
+        if self.saveTimer.isActive():
+            self.saveTimer.stop()
+            self.storeROIs()
+
+        if self.rois is not None:
+            for t, r in zip(self.realRois, self.rois):
+                # Do not store the position we are just restoring
+                t.blockSignals(True)
+                t.setPos(r.pos)
+                t.blockSignals(False)
+
+                t.setVisible(r.shown)
 
     def saveROIs(self):
         """
-        Saves the ROIs positions
+        Schedules storing the ROIs positions
+        :return:
+        """
+        if not self.saveTimer.isActive():
+            self.saveTimer.start()
+
+    def storeROIs(self):
+        """
+        Stores the ROIs positions, only if they actually changed
         :return:
         """
         for i in range(len(self.realRois)):
-            self.rois[i].pos = self.realRois[i].pos()
+            pos = self.realRois[i].pos()
+
+            if (pos[0], pos[1]) != tuple(self.rois[i].pos):
+                self.rois[i].pos = pos
 
     def getROIs(self):
         """Saves and returns the current ROIs"""
-        self.saveROIs()
+        self.saveTimer.stop()
+        self.storeROIs()
 
         return self.rois
 
@@ -146,43 +431,75 @@ class ImageView(pg.ImageView):
 
 
 class Stack(QWidget):
-    def __init__(self, files, rois=None):
+    def __init__(self, files, rois=None, mm=None, fullDepth=False, seg_files=None, showSeg=False):
         """
         Main Widget to keep track of the stack (or movie) and the ROIs.
 
-        :param stack: ndarray
+        :param files: list of image files, sorted by frame id
         :param rois: None or list of saved ROIs (json)
+        :param mm: None or memory-mapped ndarray (Z, H, W[, C]) used instead of files
+        :param fullDepth: boolean, keep the bit depth of files instead of converting to uint8
+        :param seg_files: None or list of segmentation files, sorted by frame id
+        :param showSeg: boolean, show the segmentation as overlay
         """
         super().__init__()
 
         self.files = files
+        self.seg_files = seg_files or []
+        self.showSeg = showSeg
+        self.mm = mm
+        self.fullDepth = fullDepth
+        self.n = len(mm) if mm is not None else len(files)
         self.colors = ['1a87f4', 'c17511', '9b1a9b', '0c7232']
 
-        self.rois = self.createROIs(rois)
+        self.createROIs(rois)
 
         self.curId = 0
         self.freeze = False
 
-        im = io.imread(self.files[0])
-        im = np.transpose(im, (1,0,2)) # Transpose for pyqtgraph ImageView
+        ### LRU cache of decoded frames and segmentations, filled in the background ###
+        self.cache = OrderedDict()
+        # 32 frames, plus their segmentations if there are any
+        self.cacheSize = 64 if self.seg_files else 32
+        self.cacheLock = threading.Lock()
+
+        im = self.readFrame(0)
+        self.prefetch()
+
+        # Levels are kept across z, rescanLevels refreshes them from the whole stack
+        self.levels = (float(im.min()), float(im.max()))
 
         self.dim = im.shape
-        self.w = ImageView(im, rois=self.rois[0], parent=self)
+        self.w = ImageView(im, rois=self.roisAt(0), parent=self, levels=self.levels)
+        self.w.getImageItem().setAutoDownsample(True)
+        self.setSegVisible(showSeg)
+
+        ### Keep zoom and position across z once the user changed them ###
+        self.zoomed = False
+        self.w.getView().sigRangeChangedManually.connect(self.zoomChanged)
 
         ### Create Grid Layout and add the main image window to layout ###
         self.l = QGridLayout()
         self.l.addWidget(self.w, 0, 0, 7, 1)
-        sizePolicy = QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.w.setSizePolicy(sizePolicy)
+        self.w.setSizePolicy(EXPANDING)
         self.w.show()
 
         ### Slider for z (or time) ###
         self.z = QSlider(orientation=Qt.Horizontal)
         self.z.setMinimum(0)
-        self.z.setMaximum(len(self.files)-1)
+        self.z.setMaximum(self.n-1)
         self.z.setValue(0)
         self.z.setSingleStep(1)
-        self.z.valueChanged.connect(self.changeZ)
+        self.z.valueChanged.connect(self.zChanged)
+        self.z.sliderPressed.connect(self.dragStarted)
+        self.z.sliderReleased.connect(self.dragFinished)
+
+        ### While dragging the slider, only decode the last value ###
+        self.dragging = False
+        self.dragTimer = QTimer(self)
+        self.dragTimer.setSingleShot(True)
+        self.dragTimer.setInterval(30)
+        self.dragTimer.timeout.connect(self.changeZ)
         self.w.keysignal.connect(self.keyPress)
         self.w.mousesignal.connect(self.mousePress)
 
@@ -202,7 +519,7 @@ class Stack(QWidget):
 
         ### Add another empty label to ensure nice GUI formatting ###
         self.ll = QLabel()
-        self.ll.setSizePolicy(QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Expanding))
+        self.ll.setSizePolicy(FIXED_WIDTH)
         self.l.addWidget(self.ll, 6, 1)
 
         ### Add z slider to GUI ###
@@ -216,21 +533,147 @@ class Stack(QWidget):
         self.checkROIs()
 
     def createROIs(self, rois=None):
-        tmp_rois = [[ROI([100 + i * 25, 100 + i * 25], False) for i in range(2)]
-                for _ in range(len(self.files))]
+        """
+        Creates the ROI arrays: positions (z, id, xy) and if an ROI is shown (z, id).
+
+        :param rois: None or list of saved ROIs (json)
+        """
+        self.roi_pos = np.empty((self.n, 2, 2))
+        self.roi_pos[:] = [[100, 100], [125, 125]]
+        self.roi_shown = np.zeros((self.n, 2), dtype=bool)
 
         # Loads saved ROIs
-        if type(rois) == list:
-            for r in rois:
-                tmp_rois[r['z']][r['id']].pos = r['pos']
-                tmp_rois[r['z']][r['id']].shown = True
+        if type(rois) == list and len(rois):
+            z = np.array([r['z'] for r in rois])
+            ids = np.array([r['id'] for r in rois])
+
+            self.roi_pos[z, ids] = [r['pos'] for r in rois]
+            self.roi_shown[z, ids] = True
+
+    def roisAt(self, z):
+        """
+        Returns the ROIs of frame z as views onto the ROI arrays.
+
+        :param z: frame id
+        :return: list of ROI
+        """
+        return [ROI(self, z, i) for i in range(self.roi_shown.shape[1])]
+
+    def readCached(self, path):
+        """
+        Returns the image at path, either from the cache or freshly decoded from disk.
+
+        :param path: str, image file
+        :return: ndarray
+        """
+        with self.cacheLock:
+            if path in self.cache:
+                self.cache.move_to_end(path)
+                return self.cache[path]
+
+        # Decode outside the lock to not block the UI thread
+        im = readImage(path, self.fullDepth)
+
+        with self.cacheLock:
+            self.cache[path] = im
+            self.cache.move_to_end(path)
+
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+        return im
+
+    def readFrame(self, i):
+        """
+        Returns frame i.
 
-        return tmp_rois
+        :param i: frame id
+        :return: ndarray
+        """
+        # The OS page cache takes care of memory-mapped frames
+        if self.mm is not None:
+            return self.mm[i]
+
+        return self.readCached(self.files[i])
+
+    def readSeg(self, i):
+        """
+        Returns the segmentation mask of frame i.
+
+        :param i: frame id
+        :return: ndarray (H, W) or None if there is no segmentation
+        """
+        if i >= len(self.seg_files):
+            return None
+
+        mask = self.readCached(self.seg_files[i])
+
+        # Masks are binary, a single channel suffices
+        if mask.ndim == 3:
+            mask = mask[..., 0]
+
+        return mask
+
+    def updateSeg(self):
+        """
+        Shows the segmentation of the current frame as overlay.
+        """
+        if not self.showSeg:
+            return
+
+        mask = self.readSeg(self.curId)
+
+        if mask is None:
+            self.w.seg.clear()
+
+        else:
+            self.w.seg.setImage(mask, autoLevels=False, levels=(0, 1))
+
+    def setSegVisible(self, shown):
+        """
+        Shows or hides the segmentation overlay.
+
+        :param shown: boolean
+        """
+        self.showSeg = shown
+        self.w.seg.setVisible(shown)
+        self.updateSeg()
+
+    def prefetch(self, n=2):
+        """
+        Decodes the n neighbouring frames of the current frame in the background.
+
+        :param n: number of frames to prefetch in each direction
+        """
+        if self.mm is not None and not (self.seg_files and self.showSeg):
+            return
+
+        ids = [self.curId + k * sign for k in range(1, n+1) for sign in (1, -1)]
+        ids = [i for i in ids if 0 <= i < self.n]
+
+        QThreadPool.globalInstance().start(Prefetcher(self, ids))
+
+    def rescanLevels(self, samples=32):
+        """
+        Sets the levels to the intensity range of every n-th frame of the stack.
+
+        :param samples: approximate number of frames to sample
+        """
+        lo, hi = np.inf, -np.inf
+
+        # Bypass the cache to not evict the frames around the current one
+        for i in range(0, self.n, max(1, self.n // samples)):
+            im = self.mm[i] if self.mm is not None else readImage(self.files[i], self.fullDepth)
+            lo = min(lo, float(im.min()))
+            hi = max(hi, float(im.max()))
+
+        self.levels = (lo, hi)
+        self.w.setLevels(*self.levels)
 
     def updateCheckboxes(self):
         self.freeze = True
-        self.p1.setChecked(self.rois[self.curId][0].shown)
-        self.p2.setChecked(self.rois[self.curId][1].shown)
+        self.p1.setChecked(bool(self.roi_shown[self.curId, 0]))
+        self.p2.setChecked(bool(self.roi_shown[self.curId, 1]))
         self.freeze = False
 
     def checkROIs(self):
@@ -238,10 +681,8 @@ class Stack(QWidget):
         #  meaning if I change z, and thus the checkboxes,
         #  do NOT save the current checkboxes, as it makes no sense.
         if not self.freeze:
-            self.rois[self.curId][0].shown = self.p1.isChecked()
-            self.rois[self.curId][1].shown = self.p2.isChecked()
+            self.roi_shown[self.curId] = self.p1.isChecked(), self.p2.isChecked()
 
-            self.w.rois = self.rois[self.curId]
             self.w.updateROIs()
 
     def mousePress(self, roi_id):
@@ -251,35 +692,54 @@ class Stack(QWidget):
         elif roi_id == 1:
             self.p2.setChecked(True)
 
-    def changeZ(self):
-        # Save current view state (zoom, position, ...)
-        viewBoxState = self.w.getView().getState()
+    def zChanged(self):
+        # Keys and clicks change z immediately, drags once they pause
+        if self.dragging:
+            self.dragTimer.start()
 
-        # Save current levels
-        levels = self.w.getImageItem().levels
+        else:
+            self.changeZ()
+
+    def dragStarted(self):
+        self.dragging = True
+
+    def dragFinished(self):
+        self.dragging = False
+        self.dragTimer.stop()
+        self.changeZ()
+
+    def changeZ(self):
+        # Nothing to do if the image is already shown
+        if self.z.value() == self.curId:
+            return
 
         # Save ROIs
-        self.rois[self.curId] = self.w.getROIs()
+        self.w.getROIs()
 
         # New image position
         self.curId = self.z.value()
         self.updateCheckboxes()
 
-        im = io.imread(self.files[self.curId])
-        im = np.transpose(im, (1,0,2))
+        im = self.readFrame(self.curId)
         self.dim = im.shape
+        self.prefetch()
+
+        # Set current image, keeping the levels of the previous z
+        #  (no min/max scan), and the current ROI data.
+        #  Once the user zoomed, the view range is simply left untouched.
+        self.w.swapImage(im)
+        self.updateSeg()
+
+        if not self.zoomed:
+            self.w.getView().autoRange()
 
-        # Set current image and current ROI data
-        self.w.setImage(im)
-        self.w.rois = self.rois[self.curId]
+        self.w.rois = self.roisAt(self.curId)
 
-        # Clear old ROIs and set new ROIs to scene
+        # Move ROIs to the positions of the new z
         self.w.updateROIs()
 
-        # Get old zoom and set the new zoom level the same,
-        #  repeat with the levels of previous z.
-        self.w.getView().setState(viewBoxState)
-        self.w.getImageItem().setLevels(levels)
+    def zoomChanged(self, *args):
+        self.zoomed = True
 
     def keyPress(self, key):
         # AD for -1 +1
@@ -316,9 +776,22 @@ class Main(QMainWindow):
         self.file.addAction("Open", self.open)
         self.file.addAction("Save", self.save)
 
+        self.view = self.menu.addMenu("&View")
+        self.view.addAction("Rescan levels", self.rescanLevels)
+        self.segAction = self.view.addAction("Show segmentation", self.toggleSeg)
+        self.segAction.setCheckable(True)
+
         self.folder = None
+        self.stack = None
         self.history = []
 
+        # Repaint the status bar at most every ~60 Hz while dragging ROIs
+        self.lastPos = None
+        self.statusTimer = QTimer(self)
+        self.statusTimer.setSingleShot(True)
+        self.statusTimer.setInterval(16)
+        self.statusTimer.timeout.connect(self.showPos)
+
         self.setGeometry(300, 300, 800, 600)
         self.setWindowTitle("AP Annotator")
 
@@ -330,10 +803,8 @@ class Main(QMainWindow):
         """Shows the current "z-value", i.e. the image ID, and its dimensions
         """
         self.status.showMessage('z: {} x: {} y: {}'.format(self.stack.z.value(),
-                                                           self.stack.dim[0],
-                                                           self.stack.dim[1]))
-
-        self.connectROIs()
+                                                           self.stack.dim[1],
+                                                           self.stack.dim[0]))
 
     def open(self):
         with open('settings.json', 'r') as file:
@@ -345,44 +816,85 @@ class Main(QMainWindow):
         self.status.showMessage(folder)
 
         if folder:
-            self.folder = folder
-            self.fn_rois = os.path.join(folder, "ap.points")
+            fn_rois = os.path.join(folder, "ap.points")
+
+            # Distinguish files in a single pass, keyed by their ID
+            files = []
+            seg_files = []
 
-            files_cache = glob(os.path.join(folder, "*.png"))
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    name = entry.name
 
-            # Distinguish files
-            files = [i for i in files_cache if "seg" not in i]
-            seg_files = [i for i in files_cache if "seg" in i]
+                    if not name.endswith(".png") or name.startswith("."):
+                        continue
+
+                    if "seg" in name:
+                        seg_files.append((int(name[:-8]), entry.path))
+
+                    else:
+                        files.append((int(name[:-4]), entry.path))
 
             # Sort all available files
-            self.files = sorted(files, key=lambda path: int(path.split(os.sep)[-1][:-4]))
-            self.seg_files = sorted(seg_files, key=lambda path: int(path.split(os.sep)[-1][:-8]))
+            files.sort()
+            seg_files.sort()
 
             # Check correct sorting
-            for index, file_path in enumerate(self.files):
-                file_name = file_path.split(os.sep)[-1][:-4]
-                if int(file_name) != index:
+            for index, (file_id, _) in enumerate(files):
+                if file_id != index:
                     raise AssertionError("Something went wrong when assigning and ID to an image name")
 
-            for index, file_path in enumerate(self.seg_files):
-                file_name = file_path.split(os.sep)[-1][:-8]
-                if int(file_name) != index:
+            for index, (file_id, _) in enumerate(seg_files):
+                if file_id != index:
                     raise AssertionError("Something went wrong when assigning and ID to an segmented image name")
 
+            self.files = [file_path for _, file_path in files]
+            self.seg_files = [file_path for _, file_path in seg_files]
+
+            # Warm the OS page cache in the background, only worth it on spinning disks
+            if isRotational(folder):
+                threading.Thread(target=warmPageCache, args=(self.files + self.seg_files,), daemon=True).start()
+
             # If ROI file is existing, read and decode
-            if os.path.isfile(self.fn_rois):
-                with open(self.fn_rois, 'r') as fp:
-                    rois = json.load(fp)['rois']
+            if os.path.isfile(fn_rois):
+                rois = loadPoints(fn_rois)['rois']
 
             else:
                 rois = None
 
+            # If a multi-page TIFF is existing, memory-map it instead of decoding PNGs
+            fn_tif = os.path.join(folder, "stack.tif")
+
+            if tifffile is not None and os.path.isfile(fn_tif):
+                with tifffile.TiffFile(fn_tif) as tif:
+                    mm = tif.asarray(out='memmap')
+
+            else:
+                mm = None
+
             # Create new Image pane and show first image,
             # connect slider and save function
-            self.stack = Stack(self.files, rois=rois)
+            stack = Stack(self.files, rois=rois, mm=mm,
+                          fullDepth=keys_2_settings.get("full_bit_depth", False),
+                          seg_files=self.seg_files,
+                          showSeg=self.segAction.isChecked())
+
+            # Disconnect the previous stack only once the new one exists,
+            # such that no connections pile up; setCentralWidget deletes it
+            if self.stack is not None:
+                self.stack.z.valueChanged.disconnect(self.updateStatus)
+                self.stack.w.keysignal.disconnect(self.savekeyboard)
+
+                for roi in self.stack.w.realRois:
+                    roi.sigRegionChanged.disconnect(self.p)
+
+            self.folder = folder
+            self.fn_rois = fn_rois
+            self.stack = stack
             self.setCentralWidget(self.stack)
             self.stack.z.valueChanged.connect(self.updateStatus)
             self.stack.w.keysignal.connect(self.savekeyboard)
+            self.connectROIs()
 
             self.setWindowTitle("AP Annotator | Working on folder {}".format(self.folder))
 
@@ -394,24 +906,48 @@ class Main(QMainWindow):
         e : event
             Mouse event carrying the position
         """
-        self.status.showMessage("{}".format(e.pos()))
+        self.lastPos = e.pos()
+
+        if not self.statusTimer.isActive():
+            self.statusTimer.start()
+
+    def showPos(self):
+        """Shows the last position reported by p
+        """
+        self.status.showMessage("{}".format(self.lastPos))
 
     def save(self):
         """Saves all ROIs to file
         """
         if self.fn_rois:
-            with open(self.fn_rois, "w") as fp:
-                json.dump({
-                    "rois": [{'z': i,
-                              'id': j,
-                              'pos': self.stack.rois[i][j].serialize()['pos']}
-                             for i in range(len(self.stack.rois))
-                             for j in range(len(self.stack.rois[i]))
-                             if self.stack.rois[i][j].shown]
-                }, fp, indent=4)
+            # Store pending ROI changes
+            self.stack.w.getROIs()
+
+            # Convert the shown ROIs to Python lists in one go
+            shown = self.stack.roi_shown
+            ids = np.argwhere(shown).tolist()
+            pos = self.stack.roi_pos[shown].tolist()
+
+            dumpPoints(self.fn_rois, {
+                "rois": [{'z': z, 'id': j, 'pos': p}
+                         for (z, j), p in zip(ids, pos)]
+            })
 
             self.status.showMessage("ROIs saved to {}".format(self.fn_rois), 1000)
 
+    def rescanLevels(self):
+        """Sets the levels from a sample of the whole stack
+        """
+        if self.stack is not None:
+            self.stack.rescanLevels()
+            self.status.showMessage("Levels set to {:g} - {:g}".format(*self.stack.levels), 1000)
+
+    def toggleSeg(self):
+        """Shows or hides the segmentation overlay
+        """
+        if self.stack is not None:
+            self.stack.setSegVisible(self.segAction.isChecked())
+
     def savekeyboard(self, key):
         modifiers = QApplication.keyboardModifiers()
 